@@ -1,10 +1,16 @@
 import re
+import json
 import time
-import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from urllib.parse import urljoin, urlparse
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
+from lxml import html as lxml_html
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
@@ -13,11 +19,21 @@ from selenium.webdriver.chrome.options import Options
 from selenium.common.exceptions import TimeoutException
 from tqdm import tqdm
 
+from parser_utils import RateLimiter, open_metadata
+
 BASE = "https://www.tate.org.uk"
 START_PAGE = 1
 END_PAGE = 150
 OUT_DIR = Path("tate_images")
-DELAY = 0.5
+METADATA_PATH = OUT_DIR / "metadata.jsonl" # one row per saved artwork, read back on restart
+RATE_LIMIT = 5 # requests per second to one host
+DOWNLOAD_CONCURRENCY = 20 # artworks (detail page + image) processed at once
+PER_HOST_LIMIT = 8 # open connections per host for the downloads
+SELENIUM_WORKERS = 4 # headless Chrome instances for list pages
+MIN_STATIC_ITEMS = 10 # fewer artworks in plain HTML -> render the page with Selenium
+
+LIMITER = RateLimiter(RATE_LIMIT)
+
 
 def build_collection_url(page=1):
     params = [
@@ -40,18 +56,31 @@ HEADERS = {
 
 IMG_EXT_ALLOW = {".jpg", ".jpeg", ".png", ".webp"}
 
+_SLUG_NONALNUM = re.compile(r"[^a-z0-9]+")
+_SLUG_DASHES = re.compile(r"-{2,}")
+_TITLE_CLASS_RE = re.compile(r"(title|card__title|grid-card__title)", re.I)
+_ARTIST_CLASS_RE = re.compile(r"(artist|creator|meta__artist|author|card__meta)", re.I)
+_META_CLASS_RE = re.compile(r"meta", re.I)
+_CARD_CLASS_RE = re.compile(r"(card|grid|item|artwork)", re.I)
+_EXT_RE = re.compile(r"\.(jpg|jpeg|png|webp)(?:$|\?)", re.I)
+_WORK_ID_RE = re.compile(r"/art/artworks/([^/?#]+)")
+
 
 def slugify(s, max_len=80):
     s = (s or "").strip().lower()
-    s = re.sub(r"[^a-z0-9]+", "-", s)
-    s = re.sub(r"-{2,}", "-", s).strip("-")
+    s = _SLUG_NONALNUM.sub("-", s)
+    s = _SLUG_DASHES.sub("-", s).strip("-")
     s = s[:max_len]
     return s or "item"
 
 
-def session_with_headers():
+def session_with_headers(pool_size=16):
     s = requests.Session()
     s.headers.update(HEADERS)
+    # pool must be as wide as the number of threads using the session, otherwise they wait for a free connection
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
     return s
 
 
@@ -70,6 +99,7 @@ def get_selenium_driver():
 
 def get_html_selenium(url, driver, wait_time=15, scroll_pause=2):
     try:
+        LIMITER.acquire(url)
         driver.get(url)
         
         try:
@@ -85,17 +115,21 @@ def get_html_selenium(url, driver, wait_time=15, scroll_pause=2):
         
         for i in range(8):
             driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(scroll_pause)
+            try:
+                # returns as soon as new content makes the page taller, not after the full pause
+                WebDriverWait(driver, scroll_pause).until(
+                    lambda d: d.execute_script("return document.body.scrollHeight") != last_height
+                )
+            except TimeoutException:
+                break # height is stable, everything is loaded
             
-            new_height = driver.execute_script("return document.body.scrollHeight")
-            if new_height == last_height:
-                break
-            last_height = new_height
-        
-        driver.execute_script("window.scrollTo(0, 0);")
-        time.sleep(1)
-        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-        time.sleep(2)
+            last_height = driver.execute_script("return document.body.scrollHeight")
+        else:
+            # page was still growing after the last scroll, one more pass for lazy images
+            driver.execute_script("window.scrollTo(0, 0);")
+            time.sleep(1)
+            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+            time.sleep(2)
         
         return driver.page_source
     except TimeoutException:
@@ -106,12 +140,60 @@ def get_html_selenium(url, driver, wait_time=15, scroll_pause=2):
         return None
 
 
-def get_html(url, sess, retries=3, timeout=20, delay=0.8):
+class SeleniumPool:
+    # one Chrome per worker thread, all of them are quit in close()
+    def __init__(self):
+        self._local = threading.local()
+        self._drivers = []
+        self._lock = threading.Lock()
+
+    def driver(self):
+        driver = getattr(self._local, "driver", None)
+        if driver is None:
+            driver = get_selenium_driver()
+            self._local.driver = driver
+            with self._lock:
+                self._drivers.append(driver)
+        return driver
+
+    def close(self):
+        with self._lock:
+            drivers, self._drivers = self._drivers, []
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception as e:
+                print(f"Failed to quit Selenium driver: {e}")
+
+
+def load_list_page(page, pool, sess):
+    url = build_collection_url(page=page)
+    print(f"\nProcessing page {page}: {url}")
+    
+    try:
+        # try the server-rendered HTML first, Chrome is started only for pages where it is not enough
+        html = get_html(url, sess=sess)
+        if html:
+            items = parse_list_page(html, base_url=BASE)
+            if len(items) >= MIN_STATIC_ITEMS:
+                return items
+        
+        html = get_html_selenium(url, pool.driver())
+        if not html:
+            return None
+        return parse_list_page(html, base_url=BASE)
+    except Exception as e:
+        # runs in a worker thread, one broken page must not end the whole crawl
+        print(f"Failed to process page {url}: {e}")
+        return None
+
+
+def get_html(url, sess, retries=3, timeout=20):
     for i in range(retries):
         try:
+            LIMITER.acquire(url)
             r = sess.get(url, timeout=timeout)
             if r.status_code == 200 and r.text:
-                time.sleep(delay + random.uniform(0, 0.4))
                 return r.text
         except Exception as e:
             print(f"Attempt{i+1}/{retries} to get html page is failed for url {url}: {e}")
@@ -119,21 +201,6 @@ def get_html(url, sess, retries=3, timeout=20, delay=0.8):
     return None
 
 
-def get_bytes(url, sess, retries=3, timeout=30, delay=0.5):
-    for i in range(retries):
-        try:
-            r = sess.get(url, timeout=timeout, stream=True)
-            if r.status_code == 200:
-                data = r.content
-                time.sleep(delay + random.uniform(0, 0.3))
-                return data, r.headers.get("Content-Type", "")
-        except Exception as e:
-            if i == retries - 1:
-                print(f"Failed to load image: {e}")
-        time.sleep(0.5 * (i + 1))
-    return None, None
-
-
 def parse_srcset_max(srcset):
     if not srcset:
         return None
@@ -156,14 +223,43 @@ def parse_srcset_max(srcset):
     return best_url
 
 
+def find_descendant(el, tag=None, class_re=None, attr=None):
+    # first matching descendant (not el itself), like bs4 Tag.find
+    for child in el.iterdescendants(tag):
+        if attr and child.get(attr) is None:
+            continue
+        if class_re and not class_re.search(child.get("class") or ""):
+            continue
+        return child
+    return None
+
+
+def element_text(el, sep=""):
+    # same result as bs4 get_text(sep, strip=True), which leaves out script and style contents
+    texts = el.xpath(".//text()[not(parent::script) and not(parent::style)]")
+    return sep.join(t.strip() for t in texts if t.strip())
+
+
+def find_card(a):
+    ancestors = list(a.iterancestors())
+    for el in ancestors:
+        if _CARD_CLASS_RE.search(el.get("class") or ""):
+            return el
+    for tag in ("article", "li"):
+        for el in ancestors:
+            if el.tag == tag:
+                return el
+    return a
+
+
 def extract_card_info(card_tag, base_url=BASE):
     link = None
     img_url = None
     title = None
     artist = None
     
-    a = card_tag.find("a", href=True)
-    if a:
+    a = find_descendant(card_tag, "a", attr="href")
+    if a is not None:
         href = a.get("href")
         if href:
             if href.startswith("/"):
@@ -173,21 +269,22 @@ def extract_card_info(card_tag, base_url=BASE):
         
         title = a.get("aria-label") or a.get("title")
         if not title:
-            ttl = a.find(attrs={"class": re.compile(r"(title|card__title|grid-card__title)", re.I)})
-            if ttl:
-                title = ttl.get_text(strip=True)
+            ttl = find_descendant(a, class_re=_TITLE_CLASS_RE)
+            if ttl is not None:
+                title = element_text(ttl)
             else:
-                text = a.get_text(strip=True)
+                text = element_text(a)
                 if text and len(text) > 3:
                     title = text
     
-    art_el = (card_tag.find(attrs={"class": re.compile(r"(artist|creator|meta__artist|author|card__meta)", re.I)}) or
-              card_tag.find("p", attrs={"class": re.compile(r"meta", re.I)}))
-    if art_el:
-        artist = art_el.get_text(" ", strip=True)
+    art_el = find_descendant(card_tag, class_re=_ARTIST_CLASS_RE)
+    if art_el is None:
+        art_el = find_descendant(card_tag, "p", class_re=_META_CLASS_RE)
+    if art_el is not None:
+        artist = element_text(art_el, " ")
     
-    img = card_tag.find("img")
-    if img:
+    img = find_descendant(card_tag, "img")
+    if img is not None:
         img_url = parse_srcset_max(img.get("data-srcset") or img.get("srcset") or "")
         if not img_url:
             img_url = img.get("data-src") or img.get("src")
@@ -206,10 +303,12 @@ def extract_card_info(card_tag, base_url=BASE):
 
 
 def parse_list_page(html, base_url=BASE):
-    soup = BeautifulSoup(html, "html.parser")
+    if not html.strip():
+        return []
+    tree = lxml_html.fromstring(html)
     items = []
     
-    links = soup.select('a[href*="/art/artworks/"]')
+    links = tree.xpath("//a[contains(@href, '/art/artworks/')]")
     
     print(f"Found {len(links)} links on artworks")
     
@@ -231,10 +330,7 @@ def parse_list_page(html, base_url=BASE):
             continue
         seen_urls.add(detail_url)
         
-        card = (a.find_parent(attrs={"class": re.compile(r"(card|grid|item|artwork)", re.I)}) or
-                a.find_parent("article") or
-                a.find_parent("li") or
-                a)
+        card = find_card(a)
         
         info = extract_card_info(card, base_url=base_url)
         
@@ -245,7 +341,7 @@ def parse_list_page(html, base_url=BASE):
 
 
 def parse_artwork_image_url(html, base_url=BASE):
-    soup = BeautifulSoup(html, "html.parser")
+    soup = BeautifulSoup(html, "lxml")
     
     meta = soup.find("meta", property="og:image")
     if meta and meta.get("content"):
@@ -272,7 +368,7 @@ def parse_artwork_image_url(html, base_url=BASE):
 def guess_ext_from_url_or_ct(url, content_type):
     if url:
         path = urlparse(url).path
-        m = re.search(r"\.(jpg|jpeg|png|webp)(?:$|\?)", path, re.I)
+        m = _EXT_RE.search(path)
         if m:
             ext = "." + m.group(1).lower()
             return ".jpeg" if ext == ".jpg" else ext
@@ -290,133 +386,263 @@ def guess_ext_from_url_or_ct(url, content_type):
 
 
 def extract_work_id(detail_url):
-    m = re.search(r"/art/artworks/([^/?#]+)", detail_url)
+    m = _WORK_ID_RE.search(detail_url)
     return m.group(1) if m else None
 
 
-def download_image(image_url, out_dir, base_name, sess, delay=0.5):
-    data, ct = get_bytes(image_url, sess=sess, delay=delay)
-    if not data:
+def find_existing_image(out_dir, base_name):
+    for ext in IMG_EXT_ALLOW:
+        path = out_dir / f"{base_name}{ext}"
+        if path.exists() and path.stat().st_size > 0:
+            return path
+    return None
+
+
+async def fetch_html(url, http, retries=3):
+    for i in range(retries):
+        try:
+            await LIMITER.acquire_async(url)
+            async with http.get(url) as r:
+                if r.status == 200:
+                    text = await r.text()
+                    if text:
+                        return text
+        except Exception as e:
+            print(f"Attempt{i+1}/{retries} to get html page is failed for url {url}: {e}")
+        await asyncio.sleep(0.5 * (i + 1))
+    return None
+
+
+async def remote_size_matches(url, path, http):
+    try:
+        await LIMITER.acquire_async(url)
+        async with http.head(url, allow_redirects=True) as r:
+            if r.status != 200:
+                return False
+            size = r.headers.get("Content-Length")
+            # no size from server: trust the existing file, as before
+            return not size or int(size) == path.stat().st_size
+    except Exception:
+        return False
+
+
+async def download_image(image_url, out_dir, base_name, http, retries=3, chunk_size=64 * 1024):
+    existing = find_existing_image(out_dir, base_name)
+    if existing and await remote_size_matches(image_url, existing, http):
+        return existing
+    
+    for i in range(retries):
+        try:
+            await LIMITER.acquire_async(image_url)
+            async with http.get(image_url) as r:
+                if r.status == 200:
+                    ct = r.headers.get("Content-Type", "")
+                    if ct and not ct.lower().startswith("image/"):
+                        print(f"Not an image ({ct}): {image_url}")
+                        return None
+                    
+                    ext = guess_ext_from_url_or_ct(image_url, ct)
+                    if ext.lower() not in IMG_EXT_ALLOW:
+                        ext = ".jpeg"
+                    
+                    path = out_dir / f"{base_name}{ext}"
+                    # write into .part first, so an interrupted download never looks like a finished file
+                    tmp = path.with_name(path.name + ".part")
+                    with open(tmp, "wb") as f:
+                        async for chunk in r.content.iter_chunked(chunk_size):
+                            f.write(chunk)
+                    tmp.replace(path)
+                    return path
+        except Exception as e:
+            if i == retries - 1:
+                print(f"Failed to load image {image_url}: {e}")
+        await asyncio.sleep(0.5 * (i + 1))
+    return None
+
+
+async def process_item(it, http, sem, out_dir, cwd):
+    detail_url = it.get("detail_url")
+    if not detail_url:
         return None
     
-    ext = guess_ext_from_url_or_ct(image_url, ct)
-    if ext.lower() not in IMG_EXT_ALLOW:
-        ext = ".jpeg"
+    async with sem:
+        detail_html = await fetch_html(detail_url, http)
+        if not detail_html:
+            print(f"Failed to load artwork page {detail_url}")
+            return None
+        
+        image_url = parse_artwork_image_url(detail_html, base_url=BASE) or it.get("thumb_url")
+        if not image_url:
+            print(f"Not found image for url {detail_url}")
+            return None
+        
+        work_id = extract_work_id(detail_url) or ""
+        title = (it.get("title") or "").strip()
+        artist = (it.get("artist") or "").strip()
+        
+        base_name_parts = []
+        if work_id:
+            base_name_parts.append(work_id)
+        if title:
+            base_name_parts.append(slugify(title, max_len=40))
+        elif artist:
+            base_name_parts.append(slugify(artist, max_len=40))
+        else:
+            base_name_parts.append("artwork")
+        
+        base_name = "-".join([p for p in base_name_parts if p])
+        
+        img_path = await download_image(image_url, out_dir=out_dir, base_name=base_name, http=http)
     
-    fname = f"{base_name}{ext}"
-    path = out_dir / fname
+    return {
+        "id": work_id,
+        "title": title,
+        "artist": artist,
+        "detail_url": detail_url,
+        "image_url": image_url,
+        "image_path": str(img_path.relative_to(cwd)) if img_path else "",
+        "thumb_url": it.get("thumb_url") or "",
+    }
+
+
+def load_saved_urls(path, key):
+    saved = set()
+    if not path.exists():
+        return saved
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                saved.add(json.loads(line)[key])
+            except (ValueError, KeyError):
+                continue
+    return saved
+
+
+async def download_all(queue, meta_file, cwd):
+    # consumes artworks from queue until None, one aiohttp session for all of them so connections are reused
+    sem = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+    connector = aiohttp.TCPConnector(limit=DOWNLOAD_CONCURRENCY, limit_per_host=PER_HOST_LIMIT)
+    # per socket operation like requests timeout=30, a large image on a slow link is not cut off
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=30)
+    out_dir = cwd / OUT_DIR # absolute, so image paths can be made relative to cwd
+    saved = 0
+    bar = tqdm(total=0, desc="Loading paintings", unit="item")
+    
+    async with aiohttp.ClientSession(connector=connector, headers=HEADERS, timeout=timeout) as http:
+        async def run(it):
+            nonlocal saved
+            try:
+                row = await process_item(it, http, sem, out_dir, cwd)
+            except Exception as e:
+                print(f"Error {it.get('detail_url')}: {e}")
+                row = None
+            # only artworks with a saved image are recorded, the rest are retried on the next run
+            if row and row["image_path"]:
+                meta_file.write(json.dumps(row, ensure_ascii=False) + "\n")
+                meta_file.flush()
+                saved += 1
+            bar.update(1)
+        
+        tasks = []
+        while True:
+            it = await queue.get()
+            if it is None:
+                break
+            bar.total += 1
+            bar.refresh()
+            tasks.append(asyncio.create_task(run(it)))
+        await asyncio.gather(*tasks)
     
-    if path.exists() and path.stat().st_size > 0:
-        return path
+    bar.close()
+    return saved
+
+
+def collect_items(pool, sess, emit, stop, seen_detail_urls):
+    # producer, runs in its own thread: every new artwork goes to emit(), None marks the end
+    found = 0
+    pages = range(START_PAGE, END_PAGE + 1)
     
     try:
-        path.write_bytes(data)
-        return path
-    except Exception as e:
-        print(f"Failed to save file {fname}: {e}")
-        return None
+        with ThreadPoolExecutor(max_workers=SELENIUM_WORKERS) as executor:
+            # map keeps page order, so artworks are emitted as in the sequential crawl
+            for page, items in zip(pages, executor.map(lambda p: load_list_page(p, pool, sess), pages)):
+                if stop.is_set():
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+                
+                if items is None:
+                    print(f"Failed to load page {page}")
+                    continue
+                
+                if not items:
+                    print(f"No data at page {page}")
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+                
+                new_items = 0
+                for it in items:
+                    if not it.get("detail_url") or it["detail_url"] in seen_detail_urls:
+                        continue
+                    seen_detail_urls.add(it["detail_url"])
+                    emit(it)
+                    new_items += 1
+                
+                found += new_items
+                print(f"Found {len(items)} artworks at page {page} ({new_items} are new)")
+                print(f"Total unic paintings collected: {found}")
+    finally:
+        pool.close()
+        emit(None)
+    
+    return found
+
+
+async def crawl_and_download(pool, sess, saved_urls, meta_file, cwd):
+    # list pages are crawled in a thread while the artworks found so far are already downloading
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+    
+    def emit(it):
+        loop.call_soon_threadsafe(queue.put_nowait, it)
+    
+    producer = loop.run_in_executor(None, collect_items, pool, sess, emit, stop, set(saved_urls))
+    try:
+        saved = await download_all(queue, meta_file, cwd)
+        total = await producer
+    finally:
+        stop.set()
+    return total, saved
+
 
 def main():
     OUT_DIR.mkdir(parents=True, exist_ok=True)
+    cwd = Path.cwd()
     
-    sess = session_with_headers()
-    rows = []
-    seen_detail_urls = set()
+    sess = session_with_headers(pool_size=SELENIUM_WORKERS * 2)
+    pool = SeleniumPool()
     
-    all_items = []
-    
-    print("Initializing Selenium")
-    driver = get_selenium_driver()
+    saved_urls = load_saved_urls(METADATA_PATH, "detail_url")
+    if saved_urls:
+        print(f"Resuming: {len(saved_urls)} paintings are already saved in {METADATA_PATH}")
     
     print(f"Start collecting paintings")
     
     try:
-        for page in range(START_PAGE, END_PAGE + 1):
-            url = build_collection_url(page=page)
-            print(f"\nProcessing page {page}: {url}")
-            
-            html = get_html_selenium(url, driver)
-            
-            if not html:
-                print(f"Failed to load page {page}")
-                continue
-            
-            items = parse_list_page(html, base_url=BASE)
-            if not items:
-                print(f"No data at page {page}")
-                break
-            
-            new_items = 0
-            for it in items:
-                if not it.get("detail_url") or it["detail_url"] in seen_detail_urls:
-                    continue
-                seen_detail_urls.add(it["detail_url"])
-                all_items.append(it)
-                new_items += 1
-            
-            print(f"Found {len(items)} artworks at page {page} ({new_items} are new)")
-            print(f"Total unic paintings collected: {len(all_items)}")
-            
-            if page < END_PAGE:
-                time.sleep(DELAY + random.uniform(0.5, 1.5))
+        with open_metadata(METADATA_PATH) as meta_file:
+            total, saved = asyncio.run(crawl_and_download(pool, sess, saved_urls, meta_file, cwd))
         
-        print(f"Total unic paintings collected: {len(all_items)}")
+        print(f"Total unic paintings collected: {total}")
         
-        if not all_items:
+        if not total and not saved_urls:
             print("Failed to find any artwork")
             return
         
-        for idx, it in enumerate(tqdm(all_items, desc="Loading paintings", unit="item"), 1):
-            detail_url = it.get("detail_url")
-            if not detail_url:
-                continue
-            
-            try:
-                detail_html = get_html(detail_url, sess=sess, delay=DELAY)
-                if not detail_html:
-                    print(f"[{idx}/{len(all_items)}] Failed to load artwork page {detail_url}")
-                    continue
-                
-                image_url = parse_artwork_image_url(detail_html, base_url=BASE) or it.get("thumb_url")
-                if not image_url:
-                    print(f"[{idx}/{len(all_items)}] Not found image for url {detail_url}")
-                    continue
-                
-                work_id = extract_work_id(detail_url) or ""
-                title = (it.get("title") or "").strip()
-                artist = (it.get("artist") or "").strip()
-                
-                base_name_parts = []
-                if work_id:
-                    base_name_parts.append(work_id)
-                if title:
-                    base_name_parts.append(slugify(title, max_len=40))
-                elif artist:
-                    base_name_parts.append(slugify(artist, max_len=40))
-                else:
-                    base_name_parts.append("artwork")
-                
-                base_name = "-".join([p for p in base_name_parts if p])
-                
-                img_path = download_image(image_url, out_dir=OUT_DIR, base_name=base_name, sess=sess, delay=DELAY)
-                
-                rows.append({
-                    "id": work_id,
-                    "title": title,
-                    "artist": artist,
-                    "detail_url": detail_url,
-                    "image_url": image_url,
-                    "image_path": str(img_path.relative_to(Path.cwd())) if img_path else "",
-                    "thumb_url": it.get("thumb_url") or "",
-                })
-                
-            except KeyboardInterrupt:
-                break
-            except Exception as e:
-                print(f"Error [{idx}/{len(all_items)}] {detail_url}: {e}")
-        
-        if rows:
-            print(f"Saved {len(rows)} records")
+        if saved:
+            print(f"Saved {saved} records to {METADATA_PATH}")
             print(f"Folder directory with images: {OUT_DIR.resolve()}")
         else:
             print("No data to save")
@@ -424,9 +650,8 @@ def main():
     except KeyboardInterrupt:
         print("Forced stopped")
     finally:
-        if driver:
-            driver.quit()
+        pool.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
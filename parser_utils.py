@@ -0,0 +1,48 @@
+import asyncio
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class RateLimiter:
+    # spaces requests to one host at least 1/rate seconds apart, shared by threads and the event loop
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def _reserve(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next.get(host, 0.0))
+            self._next[host] = start + self.interval
+        return start - now
+
+    def acquire(self, url):
+        wait = self._reserve(url)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, url):
+        wait = self._reserve(url)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def open_metadata(path):
+    # a run killed mid-write can leave a cut-off last line, drop it before appending
+    if path.exists():
+        with open(path, "r+b") as f:
+            pos = f.seek(0, os.SEEK_END)
+            while pos > 0:
+                step = min(4096, pos)
+                f.seek(pos - step)
+                i = f.read(step).rfind(b"\n")
+                if i != -1:
+                    pos = pos - step + i + 1
+                    break
+                pos -= step
+            f.truncate(pos)
+    return open(path, "a", encoding="utf-8")
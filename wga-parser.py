@@ -1,15 +1,25 @@
 import argparse
+import json
 import re
+import shutil
+import threading
 import time
-from dataclasses import dataclass
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
 from urllib.parse import urljoin, urlparse
 
 import pandas as pd
 import requests
-from bs4 import BeautifulSoup
-from tenacity import retry, stop_after_attempt, wait_exponential
+from bs4 import BeautifulSoup, SoupStrainer
+from lxml import html as lxml_html
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
+from urllib3.util.retry import Retry
+
+from parser_utils import RateLimiter, open_metadata
 
 BASE_URL = "https://www.wga.hu/"
 OUTPUT_DIR = Path("./wga_out")
@@ -18,19 +28,45 @@ MIN_PER_CLASS = 1000
 MAX_PER_CLASS = 1200
 MAX_PAGES_ARTIST_LIST = 500 # limit pages of artist.cgi
 MAX_INDEX_PAGES_PER_ARTIST = 200 # BFS limit for index pages inside artist folder
-DELAY = 0.5
+RATE_LIMIT = 5 # requests per second to wga.hu, shared by all threads
+BFS_WORKERS = 4 # parallel index page fetches inside one artist folder
+ARTIST_WORKERS = 8 # artists processed in parallel
+
+# parse only the subtrees that are actually read, lxml skips building the rest
+LINKS_ONLY = SoupStrainer("a", href=True)
+
+# rows of artist.cgi that hold ARTISTLIST cells, and those cells
+_ARTIST_CELL = "td[contains(concat(' ', normalize-space(@class), ' '), ' ARTISTLIST ')]"
+ARTIST_ROWS_XPATH = f"//tr[.//{_ARTIST_CELL}]"
+ARTIST_CELLS_XPATH = f".//{_ARTIST_CELL}"
+
+# image candidates on a work page, <img> is preferred over a link to the file
+ART_IMG_SRC_XPATH = "//img[contains(@src, '/art/') or starts-with(@src, 'art/')]/@src"
+ART_LINK_HREF_XPATH = "//a[contains(@href, '/art/')]/@href"
 
 PROF_KEYWORDS = [
     "painter", "sculptor", "architect", "engraver", "printmaker",
     "draughtsman", "illuminator", "miniaturist", "potter", "goldsmith"
 ]
 
+_PROF_RE = re.compile(r"\b(" + "|".join(map(re.escape, PROF_KEYWORDS)) + r")\b")
+_WHITESPACE_RE = re.compile(r"\s+")
+_NON_IDENT_RE = re.compile(r"[^a-z0-9_]+")
+_REFRESH_RE = re.compile(r"refresh", re.I)
+_REFRESH_URL_RE = re.compile(r"url\s*=\s*(.+)$", re.I)
+_MAIN_FRAME_NAME_RE = re.compile(r"main", re.I)
+_MAIN_FRAME_SRC_RE = re.compile(r'<frame[^>]+name\s*=\s*["\']?MAIN["\']?[^>]*src\s*=\s*["\']([^"\']+)["\']', re.I)
+_IMG_HREF_RE = re.compile(r"\.(jpe?g|png|gif|webp)(\?|$)", re.I)
+_ART_PATH_RE = re.compile(r'(/art/[^"\']+\.(?:jpe?g|png|gif|webp))', re.I)
+_XML_DECL_RE = re.compile(r"^\s*<\?xml[^>]*\?>")
+
 def to_lowercase_identifier(s):
     s = ("" if s is None else str(s)).strip().lower()
-    s = re.sub(r"\s+", "_", s)
-    s = re.sub(r"[^a-z0-9_]+", "", s)
+    s = _WHITESPACE_RE.sub("_", s)
+    s = _NON_IDENT_RE.sub("", s)
     return s or "unknown"
 
+@lru_cache(maxsize=100_000)
 def unwrap_wga_frames(url):
     u = (url or "").strip()
     if "/frames" in u and "?" in u:
@@ -61,68 +97,94 @@ def ext_from_url(u):
     return ".jpg"
 
 
-def same_artist_folder(artist_index_url, candidate_url):
-    a = urlparse(artist_index_url).path
-    c = urlparse(candidate_url).path
+def artist_folder(artist_index_url):
     # /html/a/aagaard/index.html -> /html/a/aagaard/
-    artist_dir = a.rsplit("/", 1)[0] + "/"
-    return c.startswith(artist_dir)
+    return urlparse(artist_index_url).path.rsplit("/", 1)[0] + "/"
 
 @dataclass
 class Fetcher:
-    delay = 0.5
-    timeout = 60
-    session = None
+    rate: float = RATE_LIMIT
+    timeout: int = 60
+    session: requests.Session = None
+    limiter: RateLimiter = None
 
     def __post_init__(self):
+        if self.limiter is None:
+            self.limiter = RateLimiter(self.rate)
         if self.session is None:
             self.session = requests.Session()
             self.session.headers.update({
-                "User-Agent": "Mozilla/5.0 (dataset research)"
+                "User-Agent": "Mozilla/5.0 (dataset research)",
+                "Connection": "keep-alive",
             })
+            # retries are done by urllib3 on the pooled connection instead of re-sending through the session
+            retries = Retry(total=5, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504))
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=retries)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
 
-    @retry(stop=stop_after_attempt(5), wait=wait_exponential(min=1, max=20))
     def get_text(self, url):
+        self.limiter.acquire(url)
         r = self.session.get(url, timeout=self.timeout)
         r.raise_for_status()
-        time.sleep(self.delay)
         return r.text
 
-    @retry(stop=stop_after_attempt(5), wait=wait_exponential(min=1, max=30))
-    def get_bytes(self, url):
-        r = self.session.get(url, timeout=max(self.timeout, 60))
-        r.raise_for_status()
-        time.sleep(self.delay)
-        return r.content
+    def download(self, url, path, chunk_size=64 * 1024):
+        self.limiter.acquire(url)
+        with self.session.get(url, timeout=max(self.timeout, 60), stream=True) as r:
+            r.raise_for_status()
+            ct = r.headers.get("Content-Type", "")
+            if ct and not ct.lower().startswith("image/"):
+                raise ValueError(f"not an image: {ct}")
+            tmp = path.with_name(path.name + ".part")
+            with open(tmp, "wb") as f:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        f.write(chunk)
+            tmp.replace(path)
 
 
 
 def extract_profession_from_school(school_text):
     t = (school_text or "").lower()
+    found = set(_PROF_RE.findall(t))
+    # keep PROF_KEYWORDS priority, not the order of words in the text
     for p in PROF_KEYWORDS:
-        if re.search(rf"\b{re.escape(p)}\b", t):
+        if p in found:
             return p
     return "unknown"
 
 
+def element_text(el):
+    # same result as bs4 get_text(" ", strip=True), which leaves out script and style contents
+    texts = el.xpath(".//text()[not(parent::script) and not(parent::style)]")
+    return " ".join(t.strip() for t in texts if t.strip())
+
+
 def parse_artist_cgi_page(html):
-    soup = BeautifulSoup(html, "html.parser")
+    # lxml refuses a str that starts with an encoding declaration, bs4 just ignored it
+    html = _XML_DECL_RE.sub("", html, count=1)
+    if not html.strip():
+        return []
+    tree = lxml_html.fromstring(html)
     out = []
 
-    for tr in soup.find_all("tr"):
-        tds = tr.find_all("td", class_="ARTISTLIST")
+    # only rows with ARTISTLIST cells are visited, not the layout tables around them
+    for tr in tree.xpath(ARTIST_ROWS_XPATH):
+        tds = tr.xpath(ARTIST_CELLS_XPATH)
         if len(tds) != 4:
             continue
 
-        a = tds[0].find("a", href=True)
-        if not a:
+        links = tds[0].xpath(".//a[@href]")
+        if not links:
             continue
+        a = links[0]
 
-        artist_name = a.get_text(" ", strip=True)
-        artist_url = unwrap_wga_frames(a["href"])
-        born_died = tds[1].get_text(" ", strip=True)
-        period = tds[2].get_text(" ", strip=True) # painting movement (e.g. Baroque, classicism, romanticism, etc.)
-        school = tds[3].get_text(" ", strip=True) # profession (e.g. German painter)
+        artist_name = element_text(a)
+        artist_url = unwrap_wga_frames(a.get("href"))
+        born_died = element_text(tds[1])
+        period = element_text(tds[2]) # painting movement (e.g. Baroque, classicism, romanticism, etc.)
+        school = element_text(tds[3]) # profession (e.g. German painter)
 
         if not period.strip():
             continue
@@ -136,14 +198,12 @@ def parse_artist_cgi_page(html):
             "profession": extract_profession_from_school(school),
         })
 
-    uniq = {}
-    for r in out:
-        uniq[r["artist_url"]] = r
-    return list(uniq.values())
+    return out
 
 
 def collect_all_artists(fetcher, only_professions, max_pages, step=50):
     all_rows = []
+    seen_urls = set()
     offset = 0
     page_i = 0
 
@@ -161,92 +221,112 @@ def collect_all_artists(fetcher, only_professions, max_pages, step=50):
         if only_professions:
             rows = [r for r in rows if r["profession"] in only_professions]
 
-        all_rows.extend(rows)
+        for r in rows:
+            if r["artist_url"] not in seen_urls:
+                seen_urls.add(r["artist_url"])
+                all_rows.append(r)
 
         offset += step
         page_i += 1
         if max_pages and page_i >= max_pages:
             break
 
-    uniq = {}
-    for r in all_rows:
-        uniq[r["artist_url"]] = r
-    return list(uniq.values())
+    return all_rows
 
 
-def collect_pages_within_artist(fetcher, artist_index_url, max_index_pages=50):
-    # BFS by index.html and the sub-indexes inside the artist page
-    artist_index_url = unwrap_wga_frames(artist_index_url)
-    queue = [artist_index_url]
-    seen = set()
-    work_pages = set()
+def scan_index_page(fetcher, artist_dir, url):
+    html = fetcher.get_text(url)
+    soup = BeautifulSoup(html, "lxml", parse_only=LINKS_ONLY)
 
-    while queue and len(seen) < max_index_pages:
-        url = queue.pop(0)
-        url = unwrap_wga_frames(url)
-        if url in seen:
+    # index pages link to the same sub-indexes many times, keep each once
+    index_pages = set()
+    work_pages = set()
+    for a in soup.find_all("a", href=True):
+        href = unwrap_wga_frames(urljoin(url, a["href"]))
+        if href in index_pages or href in work_pages:
             continue
-        seen.add(url)
 
-        try:
-            html = fetcher.get_text(url)
-        except Exception:
+        if not urlparse(href).path.startswith(artist_dir):
             continue
 
-        soup = BeautifulSoup(html, "html.parser")
-        for a in soup.find_all("a", href=True):
-            href = unwrap_wga_frames(urljoin(url, a["href"]))
+        if is_html_work_page(href):
+            work_pages.add(href)
+        elif is_html_index_page(href):
+            index_pages.add(href)
 
-            if not same_artist_folder(artist_index_url, href):
-                continue
+    return index_pages, work_pages
+
+
+def collect_pages_within_artist(fetcher, artist_index_url, max_index_pages=50, workers=BFS_WORKERS):
+    # BFS by index.html and the sub-indexes inside the artist page,
+    # discovered index pages are fetched concurrently
+    artist_index_url = unwrap_wga_frames(artist_index_url)
+    artist_dir = artist_folder(artist_index_url)
+    seen = {artist_index_url}
+    work_pages = set()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(scan_index_page, fetcher, artist_dir, artist_index_url)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                try:
+                    index_pages, works = fut.result()
+                except Exception:
+                    continue
 
-            if is_html_work_page(href):
-                work_pages.add(href)
-            elif is_html_index_page(href):
-                if href not in seen:
-                    queue.append(href)
+                work_pages.update(works)
+                for href in index_pages:
+                    if href in seen or len(seen) >= max_index_pages:
+                        continue
+                    seen.add(href)
+                    pending.add(executor.submit(scan_index_page, fetcher, artist_dir, href))
 
     return sorted(work_pages), sorted(seen)
 
 
-def _extract_meta_refresh_url(base_url, soup):
-    meta = soup.find("meta", attrs={"http-equiv": re.compile(r"refresh", re.I)})
-    if not meta:
+def _find_first(tree, tag, attr, pattern):
+    for el in tree.iter(tag):
+        if pattern.search(el.get(attr) or ""):
+            return el
+    return None
+
+
+def _extract_meta_refresh_url(base_url, tree):
+    meta = _find_first(tree, "meta", "http-equiv", _REFRESH_RE)
+    if meta is None:
         return None
     content = meta.get("content", "") or ""
-    m = re.search(r"url\s*=\s*(.+)$", content, flags=re.I)
+    m = _REFRESH_URL_RE.search(content)
     if not m:
         return None
     u = m.group(1).strip().strip("'\"")
     return urljoin(base_url, u)
 
 
-def _extract_main_frame_url(base_url, soup, html):
-    fr = soup.find("frame", attrs={"name": re.compile(r"main", re.I)})
-    if fr and fr.get("src"):
-        return urljoin(base_url, fr["src"])
+def _extract_main_frame_url(base_url, tree, html):
+    fr = _find_first(tree, "frame", "name", _MAIN_FRAME_NAME_RE)
+    if fr is not None and fr.get("src"):
+        return urljoin(base_url, fr.get("src"))
 
-    m = re.search(r'<frame[^>]+name\s*=\s*["\']?MAIN["\']?[^>]*src\s*=\s*["\']([^"\']+)["\']', html, flags=re.I)
+    m = _MAIN_FRAME_SRC_RE.search(html)
     if m:
         return urljoin(base_url, m.group(1))
 
     return None
 
 
-def _extract_image_url(base_url, soup, html):
-    for img in soup.find_all("img"):
-        src = img.get("src")
-        if not src:
-            continue
-        if "/art/" in src or src.startswith("art/") or src.startswith("../art/") or src.startswith("../../art/"):
-            return urljoin(base_url, src)
+def _extract_image_url(base_url, tree, html):
+    srcs = tree.xpath(ART_IMG_SRC_XPATH)
+    if srcs:
+        return urljoin(base_url, srcs[0])
 
-    for a in soup.find_all("a", href=True):
-        href = a["href"]
-        if "/art/" in href and re.search(r"\.(jpe?g|png|gif|webp)(\?|$)", href, flags=re.I):
+    for href in tree.xpath(ART_LINK_HREF_XPATH):
+        if _IMG_HREF_RE.search(href):
             return urljoin(base_url, href)
 
-    m = re.search(r'(/art/[^"\']+\.(?:jpe?g|png|gif|webp))', html, flags=re.I)
+    # raw html scan only when the parsed tree had nothing
+    m = _ART_PATH_RE.search(html)
     if m:
         return urljoin(base_url, m.group(1))
 
@@ -255,19 +335,28 @@ def _extract_image_url(base_url, soup, html):
 
 def parse_artwork_page(fetcher, work_url):
     work_url = unwrap_wga_frames(work_url)
+    pages = {} # url -> (html, tree), so each page is fetched and parsed once
+
+    def load(url):
+        if url not in pages:
+            html = fetcher.get_text(url)
+            html = _XML_DECL_RE.sub("", html, count=1)
+            pages[url] = (html, lxml_html.document_fromstring(html) if html.strip() else None)
+        return pages[url]
 
     for _ in range(3):
-        html = fetcher.get_text(work_url)
-        soup = BeautifulSoup(html, "html.parser")
+        html, tree = load(work_url)
+        if tree is None:
+            return None
 
-        refresh_url = _extract_meta_refresh_url(work_url, soup)
+        refresh_url = _extract_meta_refresh_url(work_url, tree)
         if refresh_url:
             new_url = unwrap_wga_frames(refresh_url)
             if new_url != work_url:
                 work_url = new_url
                 continue
 
-        main_url = _extract_main_frame_url(work_url, soup, html)
+        main_url = _extract_main_frame_url(work_url, tree, html)
         if main_url:
             new_url = unwrap_wga_frames(main_url)
             if new_url != work_url:
@@ -276,19 +365,20 @@ def parse_artwork_page(fetcher, work_url):
 
         break
 
-    html = fetcher.get_text(work_url)
-    soup = BeautifulSoup(html, "html.parser")
+    html, tree = load(work_url)
+    if tree is None:
+        return None
 
-    img_url = _extract_image_url(work_url, soup, html)
+    img_url = _extract_image_url(work_url, tree, html)
     if not img_url:
         return None
 
     meta = {}
-    for tr in soup.find_all("tr"):
-        tds = tr.find_all(["td", "th"])
+    for tr in tree.iter("tr"):
+        tds = tr.xpath(".//td|.//th")
         if len(tds) >= 2:
-            k = tds[0].get_text(" ", strip=True).rstrip(":")
-            v = tds[1].get_text(" ", strip=True)
+            k = element_text(tds[0]).rstrip(":")
+            v = element_text(tds[1])
             if k and v and len(k) <= 60:
                 meta[k] = v
 
@@ -302,148 +392,268 @@ def parse_artwork_page(fetcher, work_url):
         "date": date,
     }
 
-def build_dataset(out_dir,
-                  only_professions,
-                  min_per_class,
-                  max_per_class,
-                  max_index_pages_per_artist,
-                  max_pages_artist_list,
-                  sleep):
 
-    out_dir.mkdir(parents=True, exist_ok=True)
-    img_root = out_dir / "images"
-    img_root.mkdir(parents=True, exist_ok=True)
-
-    fetcher = Fetcher(sleep=sleep)
+def load_metadata_state(path, counts, seen_work_urls, seen_image_urls):
+    # restores counters of an earlier run from its metadata.jsonl, returns the next free sample id
+    next_id = 0
+    if not path.exists():
+        return next_id
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                r = json.loads(line)
+            except ValueError:
+                continue
+            next_id = max(next_id, int(r["id"].rsplit("_", 1)[1]) + 1)
+            # rows of classes removed by the min_per_class filter stay in the log, their files do not
+            if not Path(r["local_path"]).exists():
+                continue
+            counts[r["movement_id"]] = counts.get(r["movement_id"], 0) + 1
+            seen_work_urls.add(r["work_url"])
+            seen_image_urls.add(r["image_url"])
+    return next_id
 
-    print("Collecting artists")
-    artists = collect_all_artists(fetcher,
-                                  only_professions=only_professions,
-                                  max_pages=max_pages_artist_list)
 
-    print(f"Collected {len(artists)} artists")
+@dataclass
+class CrawlState:
+    # everything the artist threads share, changed only under lock
+    meta_file: object
+    max_per_class: int
+    counts: Counter = field(default_factory=Counter)
+    seen_work_urls: set = field(default_factory=set)
+    seen_image_urls: set = field(default_factory=set)
+    class_dirs: set = field(default_factory=set)
+    next_id: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    stop: threading.Event = field(default_factory=threading.Event) # set on Ctrl-C, running artists finish their current image
+
+    def is_full(self, movement_id):
+        with self.lock:
+            return self.counts[movement_id] >= self.max_per_class
+
+    def all_full(self, movement_ids):
+        with self.lock:
+            return all(self.counts[m] >= self.max_per_class for m in movement_ids)
+
+    def reserve(self, movement_id, image_url):
+        # takes a place in the class and a sample id before the download, returns (sample_id, reason)
+        with self.lock:
+            if image_url in self.seen_image_urls:
+                return None, "duplicate"
+            if self.counts[movement_id] >= self.max_per_class:
+                return None, "full"
+            self.seen_image_urls.add(image_url)
+            self.counts[movement_id] += 1
+            sample_id = self.next_id
+            self.next_id += 1
+            return sample_id, None
+
+    def release(self, movement_id):
+        # download failed, give the place in the class back
+        with self.lock:
+            self.counts[movement_id] -= 1
+
+    def class_dir(self, img_root, movement_id):
+        # created on the first image of the class, so no mkdir per image and no empty class folders
+        cls_dir = img_root / movement_id
+        if movement_id not in self.class_dirs:
+            cls_dir.mkdir(parents=True, exist_ok=True)
+            with self.lock:
+                self.class_dirs.add(movement_id)
+        return cls_dir
+
+    def save(self, row):
+        with self.lock:
+            self.meta_file.write(json.dumps(row, ensure_ascii=False) + "\n")
+            self.meta_file.flush()
+
+
+def process_artist(ai, total_artists, a, fetcher, state, img_root, max_index_pages_per_artist):
+    max_per_class = state.max_per_class
+    movement = a["movement_raw"].strip()
+    movement_id = to_lowercase_identifier(movement)
+
+    if movement_id == "unknown":
+        print(f"[{ai}/{total_artists}] skip: {a['artist_name']} (unknown movement)")
+        return
+
+    if state.is_full(movement_id):
+        print(f"[{ai}/{total_artists}] SKIP: {a['artist_name']} "
+              f"(class '{movement_id}' is full: {state.counts[movement_id]}/{max_per_class})")
+        return
+
+    artist_url = unwrap_wga_frames(a["artist_url"])
+    if not artist_url.lower().endswith("/index.html"):
+        if artist_url.endswith("/"):
+            artist_url += "index.html"
+        else:
+            artist_url = artist_url.rstrip("/") + "/index.html"
+
+    print(f"[{ai}/{total_artists}] artist: {a['artist_name']} | prof={a['profession']} | "
+          f"movement='{movement}' | class_count={state.counts[movement_id]}/{max_per_class}")
+    print(f"[{ai}/{total_artists}] index: {artist_url}")
+
+    t0 = time.time()
+    try:
+        work_pages, seen_indexes = collect_pages_within_artist(
+            fetcher, artist_url, max_index_pages=max_index_pages_per_artist
+        )
+    except Exception as e:
+        print(f"[{ai}/{total_artists}] error: failed to collect pages: {e}")
+        return
+
+    print(f"[{ai}/{total_artists}] pages: index_seen={len(seen_indexes)} | works_found={len(work_pages)} | time={time.time()-t0:.1f}s")
+
+    artist_downloaded = 0
+    artist_noimg = 0
+    artist_dup = 0
+    artist_errors = 0
+
+    for wi, wp in enumerate(work_pages, start=1):
+        if state.stop.is_set():
+            break
 
-    rows = []
-    counts = {}
-    seen_image_urls = set()
-    sample_id = 0
+        if state.is_full(movement_id):
+            print(f"[{ai}/{total_artists}] stop: class '{movement_id}' reached max {max_per_class}")
+            break
 
-    total_artists = len(artists)
+        if wp in state.seen_work_urls:
+            continue
 
-    for ai, a in enumerate(tqdm(artists, desc="Artists"), start=1):
-        movement = a["movement_raw"].strip()
-        movement_id = to_lowercase_identifier(movement)
+        try:
+            art = parse_artwork_page(fetcher, wp)
+            if not art:
+                artist_noimg += 1
+                if artist_noimg <= 3:
+                    print(f"[{ai}/{total_artists}] no image on: {wp}")
+                elif artist_noimg % 25 == 0:
+                    print(f"[{ai}/{total_artists}] no-image pages so far: {artist_noimg}")
+                continue
 
-        if movement_id == "unknown":
-            print(f"[{ai}/{total_artists}] skip: {a['artist_name']} (unknown movement)")
-            continue
+            sample_id, reason = state.reserve(movement_id, art["image_url"])
+            if reason == "full":
+                print(f"[{ai}/{total_artists}] stop: class '{movement_id}' reached max {max_per_class}")
+                break
+            if reason == "duplicate":
+                artist_dup += 1
+                if artist_dup <= 3:
+                    print(f"[{ai}/{total_artists}] duplicate image: {art['image_url']}")
+                elif artist_dup % 25 == 0:
+                    print(f"[{ai}/{total_artists}] duplicates so far: {artist_dup}")
+                continue
 
-        if counts.get(movement_id, 0) >= max_per_class:
-            print(f"[{ai}/{total_artists}] SKIP: {a['artist_name']} "
-                  f"(class '{movement_id}' is full: {counts.get(movement_id, 0)}/{max_per_class})")
-            continue
+            ext = ext_from_url(art["image_url"])
+            cls_dir = state.class_dir(img_root, movement_id)
 
-        artist_url = unwrap_wga_frames(a["artist_url"])
-        if not artist_url.lower().endswith("/index.html"):
-            if artist_url.endswith("/"):
-                artist_url += "index.html"
-            else:
-                artist_url = artist_url.rstrip("/") + "/index.html"
+            img_name = f"wga_{sample_id:09d}{ext}"
+            local_path = cls_dir / img_name
 
-        print(f"[{ai}/{total_artists}] artist: {a['artist_name']} | prof={a['profession']} | "
-              f"movement='{movement}' | class_count={counts.get(movement_id, 0)}/{max_per_class}")
-        print(f"[{ai}/{total_artists}] index: {artist_url}")
+            if wi == 1 or wi % 20 == 0:
+                print(f"[{ai}/{total_artists}] scanning works: {wi}/{len(work_pages)} "
+                      f"(downloaded={artist_downloaded}, class={state.counts[movement_id]}/{max_per_class})")
 
-        t0 = time.time()
-        try:
-            work_pages, seen_indexes = collect_pages_within_artist(
-                fetcher, artist_url, max_index_pages=max_index_pages_per_artist
-            )
-        except Exception as e:
-            print(f"[{ai}/{total_artists}] error: failed to collect pages: {e}")
-            continue
+            try:
+                if not local_path.exists():
+                    fetcher.download(art["image_url"], local_path)
+            except Exception:
+                state.release(movement_id)
+                raise
+
+            state.save({
+                "id": f"wga_{sample_id:09d}",
+                "movement": movement,
+                "movement_id": movement_id,
+                "profession": a["profession"],
+                "school_raw": a["school_raw"],
+                "artist_name": a["artist_name"],
+                "artist_url": artist_url,
+                "work_url": art["work_url"],
+                "image_url": art["image_url"],
+                "title": art.get("title", ""),
+                "date": art.get("date", ""),
+                "local_path": str(local_path),
+            })
 
-        print(f"[{ai}/{total_artists}] pages: index_seen={len(seen_indexes)} | works_found={len(work_pages)} | time={time.time()-t0:.1f}s")
+            artist_downloaded += 1
 
-        artist_downloaded = 0
-        artist_noimg = 0
-        artist_dup = 0
-        artist_errors = 0
+            print(f"[{ai}/{total_artists}] downloaded {artist_downloaded} | "
+                  f"class={state.counts[movement_id]}/{max_per_class} | "
+                  f"title='{art.get('title','')[:80]}' | file={local_path.name}")
 
-        for wi, wp in enumerate(work_pages, start=1):
-            if counts.get(movement_id, 0) >= max_per_class:
-                print(f"[{ai}/{total_artists}] stop: class '{movement_id}' reached max {max_per_class}")
-                break
+        except Exception as e:
+            artist_errors += 1
+            if artist_errors <= 5:
+                print(f"[{ai}/{total_artists}] error at page: {wp} | {e}")
+            elif artist_errors % 50 == 0:
+                print(f"[{ai}/{total_artists}] errors so far: {artist_errors}")
+            continue
 
-            try:
-                art = parse_artwork_page(fetcher, wp)
-                if not art:
-                    artist_noimg += 1
-                    if artist_noimg <= 3:
-                        print(f"[{ai}/{total_artists}] no image on: {wp}")
-                    elif artist_noimg % 25 == 0:
-                        print(f"[{ai}/{total_artists}] no-image pages so far: {artist_noimg}")
-                    continue
+    print(f"[{ai}/{total_artists}] done: {a['artist_name']} | "
+          f"downloaded={artist_downloaded} | noimg={artist_noimg} | dup={artist_dup} | errors={artist_errors}\n")
 
-                if art["image_url"] in seen_image_urls:
-                    artist_dup += 1
-                    if artist_dup <= 3:
-                        print(f"[{ai}/{total_artists}] duplicate image: {art['image_url']}")
-                    elif artist_dup % 25 == 0:
-                        print(f"[{ai}/{total_artists}] duplicates so far: {artist_dup}")
-                    continue
-                seen_image_urls.add(art["image_url"])
 
-                ext = ext_from_url(art["image_url"])
-                cls_dir = img_root / movement_id
-                cls_dir.mkdir(parents=True, exist_ok=True)
+def build_dataset(out_dir,
+                  only_professions,
+                  min_per_class,
+                  max_per_class,
+                  max_index_pages_per_artist,
+                  max_pages_artist_list,
+                  rate):
 
-                img_name = f"wga_{sample_id:09d}{ext}"
-                local_path = cls_dir / img_name
+    out_dir.mkdir(parents=True, exist_ok=True)
+    img_root = out_dir / "images"
+    img_root.mkdir(parents=True, exist_ok=True)
+    meta_path = out_dir / "metadata.jsonl" # one row per downloaded image, also used to resume
 
-                if wi == 1 or wi % 20 == 0:
-                    print(f"[{ai}/{total_artists}] scanning works: {wi}/{len(work_pages)} "
-                          f"(downloaded={artist_downloaded}, class={counts.get(movement_id, 0)}/{max_per_class})")
+    fetcher = Fetcher(rate=rate)
 
-                if not local_path.exists():
-                    data = fetcher.get_bytes(art["image_url"])
-                    local_path.write_bytes(data)
-
-                rows.append({
-                    "id": f"wga_{sample_id:09d}",
-                    "movement": movement,
-                    "movement_id": movement_id,
-                    "profession": a["profession"],
-                    "school_raw": a["school_raw"],
-                    "artist_name": a["artist_name"],
-                    "artist_url": artist_url,
-                    "work_url": art["work_url"],
-                    "image_url": art["image_url"],
-                    "title": art.get("title", ""),
-                    "date": art.get("date", ""),
-                    "local_path": str(local_path),
-                })
-
-                artist_downloaded += 1
-                sample_id += 1
-                counts[movement_id] = counts.get(movement_id, 0) + 1
-
-                print(f"[{ai}/{total_artists}] downloaded {artist_downloaded} | "
-                      f"class={counts.get(movement_id, 0)}/{max_per_class} | "
-                      f"title='{art.get('title','')[:80]}' | file={local_path.name}")
-
-            except Exception as e:
-                artist_errors += 1
-                if artist_errors <= 5:
-                    print(f"[{ai}/{total_artists}] error at page: {wp} | {e}")
-                elif artist_errors % 50 == 0:
-                    print(f"[{ai}/{total_artists}] errors so far: {artist_errors}")
-                continue
+    print("Collecting artists")
+    artists = collect_all_artists(fetcher,
+                                  only_professions=only_professions,
+                                  max_pages=max_pages_artist_list)
 
-        print(f"[{ai}/{total_artists}] done: {a['artist_name']} | "
-              f"downloaded={artist_downloaded} | noimg={artist_noimg} | dup={artist_dup} | errors={artist_errors}\n")
+    print(f"Collected {len(artists)} artists")
 
-    df = pd.DataFrame(rows)
+    total_artists = len(artists)
+    movement_ids = {to_lowercase_identifier(a["movement_raw"].strip()) for a in artists} - {"unknown"}
+
+    with open_metadata(meta_path) as meta_file:
+        state = CrawlState(meta_file=meta_file, max_per_class=max_per_class)
+        state.next_id = load_metadata_state(meta_path, state.counts, state.seen_work_urls, state.seen_image_urls)
+        if state.next_id:
+            print(f"Resuming: {sum(state.counts.values())} images are already saved in {meta_path}")
+
+        with ThreadPoolExecutor(max_workers=ARTIST_WORKERS) as executor:
+            futures = {
+                executor.submit(process_artist, ai, total_artists, a, fetcher, state,
+                                img_root, max_index_pages_per_artist): a
+                for ai, a in enumerate(artists, start=1)
+            }
+            try:
+                for fut in tqdm(as_completed(futures), total=len(futures), desc="Artists"):
+                    try:
+                        fut.result()
+                    except Exception as e:
+                        print(f"error: artist {futures[fut]['artist_name']} failed: {e}")
+
+                    if movement_ids and state.all_full(movement_ids):
+                        print(f"All classes reached max {max_per_class}, stopping")
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        break
+            except BaseException:
+                # Ctrl-C: drop the queued artists, otherwise leaving the with block would still run all of them
+                state.stop.set()
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    if meta_path.stat().st_size > 0:
+        df = pd.read_json(meta_path, lines=True, dtype=False, convert_dates=False)
+        df = df.loc[df["local_path"].map(lambda p: Path(p).exists())].reset_index(drop=True)
+    else:
+        df = pd.DataFrame()
 
     if not df.empty and min_per_class > 1:
         vc = df["movement_id"].value_counts()
@@ -452,19 +662,12 @@ def build_dataset(out_dir,
 
         if drop:
             for slug in drop:
-                cls_dir = img_root / slug
-                if cls_dir.exists():
-                    for p in cls_dir.glob("*"):
-                        try:
-                            p.unlink()
-                        except Exception:
-                            pass
-                    try:
-                        cls_dir.rmdir()
-                    except Exception:
-                        pass
+                shutil.rmtree(img_root / slug, ignore_errors=True)
 
-            df = df[df["movement_id"].isin(keep)].reset_index(drop=True)
+            df["movement_id"] = df["movement_id"].astype("category")
+            keep_mask = df["movement_id"].isin(keep)
+            df = df.loc[keep_mask].reset_index(drop=True)
+            df["movement_id"] = df["movement_id"].cat.remove_unused_categories()
 
     return df
 
@@ -480,7 +683,7 @@ def main():
         max_per_class=MAX_PER_CLASS,
         max_pages_artist_list=MAX_PAGES_ARTIST_LIST,
         max_index_pages_per_artist=MAX_INDEX_PAGES_PER_ARTIST,
-        sleep=DELAY,
+        rate=RATE_LIMIT,
     )
 
     print(f"Collecting painting is completed, saved {len(df)} paintings")